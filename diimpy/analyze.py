@@ -4,227 +4,130 @@
 # LICENSE.txt or http://www.opensource.org/licenses/mit-license.php for terms
 # and conditions.
 
-import numpy as np
 import pandas as pd
 
 from openpyxl import load_workbook
 
 
-def analyze_dependency(model, sheet_name="Dependency"):
-    """Analyze dependencies and influence gains."""
-    #
-    # Output is written to existing datafile (xslx).
-    #
-    wb = load_workbook(model.config["datafile"])
-    if sheet_name in wb.sheetnames:
-        del wb[sheet_name]
-    ws = wb.create_sheet(sheet_name)
+class AnalysisSession:
+    """Context manager keeping the datafile (xlsx) of a model open across
+    several analyses.
 
-    header = ["function", "delta", "delta_overall", "rho", "rho_overall"]
-    ws.append(header)
+    Example:
+        with AnalysisSession(model) as session:
+            analyze_dependency(model, wb=session.wb)
+            analyze_inoperability(model, wb=session.wb)
+    """
 
-    delta = model.dependency()
-    delta_overall = model.overall_dependency()
-    rho = model.influence()
-    rho_overall = model.overall_influence()
+    def __init__(self, model):
+        self.model = model
+        self.wb = None
 
-    res = []
-    for f, d, do, r, ro in zip(model.infra, delta, delta_overall, rho, rho_overall):
-        row = [f, d, do, r, ro]
-        ws.append(row)
-        res.append(row)
+    def __enter__(self):
+        self.wb = load_workbook(self.model.config["datafile"])
+        return self
 
-    wb.save(filename=model.config["datafile"])
-    return pd.DataFrame(res, columns=header)
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.wb.save(filename=self.model.config["datafile"])
 
 
-def analyze_interdependency(model, sheet_name="Interdependency"):
-    """Analyze first-, second- and third-order interdependencies."""
+def _write_sheet(model, df, sheet_name, wb=None, rows=()):
+    # Write a data frame, followed by any extra rows, to a sheet.
     #
-    # Output is written to existing datafile (xslx).
+    # Output is written to existing datafile (xslx), or to wb if provided.
+    # An existing sheet with the same name is replaced.
     #
-    wb = load_workbook(model.config["datafile"])
+    save = wb is None
+    if save:
+        wb = load_workbook(model.config["datafile"])
     if sheet_name in wb.sheetnames:
         del wb[sheet_name]
     ws = wb.create_sheet(sheet_name)
 
-    header = ["i", "j", "max(aij)", "i", "j", "max(aij^2)", "i", "j", "max(aij^3)"]
-    ws.append(header)
-
-    first = model.max_nth_order_interdependency(1)
-    second = model.max_nth_order_interdependency(2)
-    third = model.max_nth_order_interdependency(3)
-
-    res = []
-    for i in range(len(model)):
-        row = [
-            first[i][0],
-            first[i][1],
-            first[i][2],
-            second[i][0],
-            second[i][1],
-            second[i][2],
-            third[i][0],
-            third[i][1],
-            third[i][2],
-        ]
+    ws.append(list(df.columns))
+    for row in df.itertuples(index=False, name=None):
         ws.append(row)
-        res.append(row)
-
-    wb.save(filename=model.config["datafile"])
-    return pd.DataFrame(res, columns=header)
-
-
-def analyze_inoperability(model, sheet_name="Static_inoperability"):
-    """Analyze inoperabilities at equilibrium."""
-    #
-    # Output is written to existing datafile (xslx).
-    #
-    wb = load_workbook(model.config["datafile"])
-    if sheet_name in wb.sheetnames:
-        del wb[sheet_name]
-    ws = wb.create_sheet(sheet_name)
-
-    header = ["infrastructure", "inoperability"]
-    ws.append(header)
-
-    q = model.inoperability()
-
-    res = []
-    for i in range(len(model)):
-        row = [model.infra[i], q[i]]
+    for row in rows:
         ws.append(row)
-        res.append(row)
 
-    wb.save(filename=model.config["datafile"])
-    return pd.DataFrame(res, columns=header)
+    if save:
+        wb.save(filename=model.config["datafile"])
 
 
-def analyze_dynamic_inoperability(model, sheet_name="Dynamic_inoperability"):
-    """Analyze dynamic inoperabilities."""
-    #
-    # Output is written to existing datafile (xslx).
-    #
-    wb = load_workbook(model.config["datafile"])
-    if sheet_name in wb.sheetnames:
-        del wb[sheet_name]
-    ws = wb.create_sheet(sheet_name)
+def analyze_dependency(model, sheet_name="Dependency", wb=None):
+    """Analyze dependencies and influence gains."""
+    delta, delta_overall, rho, rho_overall = model._indices()
+    df = pd.DataFrame(
+        {
+            "function": model.infra,
+            "delta": delta,
+            "delta_overall": delta_overall,
+            "rho": rho,
+            "rho_overall": rho_overall,
+        }
+    )
+    _write_sheet(model, df, sheet_name, wb)
+    return df
+
+
+def analyze_interdependency(model, sheet_name="Interdependency", wb=None):
+    """Analyze first-, second- and third-order interdependencies."""
+    header = ["i", "j", "max(aij)", "i", "j", "max(aij^2)", "i", "j", "max(aij^3)"]
 
-    header = ["time"]
-    for item in model.infra:
-        header.append(item)
-    ws.append(header)
+    first, second, third = [model._max_row(amat) for amat in model._powers(3)]
+    res = [a + b + c for a, b, c in zip(first, second, third)]
+    df = pd.DataFrame(res, columns=header)
+    _write_sheet(model, df, sheet_name, wb)
+    return df
 
-    qt = model.dynamic_inoperability()
-    qtot = model.impact(qt)
 
-    res = []
-    for i in range(np.size(qt, 0)):
-        row = [qt[i, 0]]
-        for j in range(1, np.size(qt, 1)):
-            row.append(qt[i, j])
-        ws.append(row)
-        res.append(row)
+def analyze_inoperability(model, sheet_name="Static_inoperability", wb=None):
+    """Analyze inoperabilities at equilibrium."""
+    df = pd.DataFrame(
+        {"infrastructure": model.infra, "inoperability": model.inoperability()}
+    )
+    _write_sheet(model, df, sheet_name, wb)
+    return df
 
-    row = ["qtot"]
-    for item in qtot:
-        row.append(item)
-    ws.append(row)
 
-    wb.save(filename=model.config["datafile"])
-    return pd.DataFrame(res, columns=header), qtot
+def analyze_dynamic_inoperability(model, sheet_name="Dynamic_inoperability", wb=None):
+    """Analyze dynamic inoperabilities."""
+    return _analyze_dynamic(model, model.dynamic_inoperability(), sheet_name, wb)
 
 
-def analyze_dynamic_recovery(model, sheet_name="Recovery"):
+def analyze_dynamic_recovery(model, sheet_name="Recovery", wb=None):
     """Analyze dynamic recovery."""
-    #
-    # Output is written to existing datafile (xslx).
-    #
-    wb = load_workbook(model.config["datafile"])
-    if sheet_name in wb.sheetnames:
-        del wb[sheet_name]
-    ws = wb.create_sheet(sheet_name)
+    return _analyze_dynamic(model, model.dynamic_recovery(), sheet_name, wb)
 
-    header = ["time"]
-    for item in model.infra:
-        header.append(item)
-    ws.append(header)
 
-    qt = model.dynamic_recovery()
+def _analyze_dynamic(model, qt, sheet_name, wb):
+    # Write dynamic inoperabilities q(t) and their impact to a sheet.
+    df = pd.DataFrame(qt, columns=["time", *model.infra])
     qtot = model.impact(qt)
+    _write_sheet(model, df, sheet_name, wb, rows=[["qtot", *qtot.tolist()]])
+    return df, qtot
 
-    res = []
-    for i in range(np.size(qt, 0)):
-        row = [qt[i, 0]]
-        for j in range(1, np.size(qt, 1)):
-            row.append(qt[i, j])
-        ws.append(row)
-        res.append(row)
-
-    row = ["qtot"]
-    for item in qtot:
-        row.append(item)
-    ws.append(row)
-
-    wb.save(filename=model.config["datafile"])
-    return pd.DataFrame(res, columns=header), qtot
 
-
-def single_attack_sampling(model, sheet_name="Single_attack", ptime=None, cvalue=None):
+def single_attack_sampling(model, sheet_name="Single_attack", ptime=None, cvalue=None, wb=None):
     """Run DIIM single attack sampling."""
-    #
-    # Output is written to existing datafile (xslx).
-    #
-    wb = load_workbook(model.config["datafile"])
-    if sheet_name in wb.sheetnames:
-        del wb[sheet_name]
-    ws = wb.create_sheet(sheet_name)
-
-    header = ["infra", "impact"]
-    ws.append(header)
-
-    res = []
-    for item in model.infra:
-        model.set_perturbation(pinfra=[item], ptime=ptime, cvalue=cvalue)
-        qt = model.dynamic_inoperability()
-        qtot = model.impact(qt)
-        row = [item, np.sum(qtot)]
-        ws.append(row)
-        res.append(row)
-
-    wb.save(filename=model.config["datafile"])
-    return pd.DataFrame(res, columns=header)
+    samples = [[item] for item in model.infra]
+    impact = model.sampling_impact(samples, ptime=ptime, cvalue=cvalue)
+    df = pd.DataFrame({"infra": model.infra, "impact": impact})
+    _write_sheet(model, df, sheet_name, wb)
+    return df
 
 
-def hybrid_attack_sampling(model, sheet_name="Hybrid_attack", ptime=None, cvalue=None):
+def hybrid_attack_sampling(model, sheet_name="Hybrid_attack", ptime=None, cvalue=None, wb=None):
     """Run DIIM hybrid attack sampling."""
-    #
-    # Output is written to existing datafile (xslx).
-    #
-    wb = load_workbook(model.config["datafile"])
-    if sheet_name in wb.sheetnames:
-        del wb[sheet_name]
-    ws = wb.create_sheet(sheet_name)
-
-    header = ["infra_i", "infra_j", "impact"]
-    ws.append(header)
-
     if ptime is None:
         ptime = [model.perturb.config["ptime"][0], model.perturb.config["ptime"][0]]
     if cvalue is None:
         cvalue = [model.perturb.config["cvalue"][0], model.perturb.config["cvalue"][0]]
 
-    res = []
-    for ii in model.infra:
-        for jj in model.infra:
-            if ii == jj:
-                continue
-            model.set_perturbation(pinfra=[ii, jj], ptime=ptime, cvalue=cvalue)
-            qt = model.dynamic_inoperability()
-            qtot = model.impact(qt)
-            row = [ii, jj, np.sum(qtot)]
-            ws.append(row)
-            res.append(row)
-
-    wb.save(filename=model.config["datafile"])
-    return pd.DataFrame(res, columns=header)
+    samples = [[ii, jj] for ii in model.infra for jj in model.infra if ii != jj]
+    impact = model.sampling_impact(samples, ptime=ptime, cvalue=cvalue)
+    df = pd.DataFrame(samples, columns=["infra_i", "infra_j"])
+    df["impact"] = impact
+    _write_sheet(model, df, sheet_name, wb)
+    return df
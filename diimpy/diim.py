@@ -8,8 +8,8 @@ import math
 import numpy as np
 import pandas as pd
 
-from scipy.linalg import expm
 from scipy.integrate import trapezoid
+from scipy.linalg import expm, lu_factor, lu_solve
 from diimpy.perturbation import Perturbation 
 from diimpy.mapping import map_to_interdep
 
@@ -51,6 +51,70 @@ the papers:
    dependency assessment using the input-output inoperability model.
    International Journal of Critical Infrastructure Protection, 2, 170-178.
 """
+
+
+def _diim_step(astar, kmat, q0, cstar, nt):
+    """Integrate the demand-reduction DIIM over nt time steps."""
+    #
+    # Note:
+    #   Row k of cstar holds the perturbation c*(k). The update
+    #
+    #     q(k + 1) = K [A* q(k) + c*(k) - q(k)] + q(k)
+    #
+    #   is evaluated as q(k + 1) = M q(k) + K c*(k) with the constant
+    #   matrix M = K A* + I - K.
+    #
+    n = len(q0)
+    mmat = _step_matrix(astar, kmat)
+    kc = cstar @ kmat.T
+    qt = np.zeros(shape=(nt, n + 1), dtype=mmat.dtype)
+    qt[1:, 0] = np.arange(1, nt)
+    qk = q0
+    for k in range(1, nt):
+        # q(k) is computed in place in row k of qt:
+        np.matmul(mmat, qk, out=qt[k, 1:])
+        qk = qt[k, 1:]
+        np.add(qk, kc[k], out=qk)
+        np.minimum(qk, 1.0, out=qk) # upper limit (fix roundoff errors)
+    return qt
+
+
+def _diim_step_batch(astar, kmat, q0, terms, nsamples, nt):
+    """Integrate the demand-reduction DIIM for a batch of perturbations and
+    return the total impact of each."""
+    #
+    # Note:
+    #   terms = (sample, index, tlo, thi, value) lists the perturbations of
+    #   all samples: c*_index(k) = value for tlo <= k <= thi in the given
+    #   sample. All samples are advanced together, one matrix product per
+    #   time step, and only q(k) of the current step is kept. The impact is
+    #   accumulated by the trapezoidal rule, with q(0) = 0 as in _diim_step.
+    #
+    sample, index, tlo, thi, value = terms
+    mmat = _step_matrix(astar, kmat)
+    qk = np.empty(shape=(nsamples, len(q0)), dtype=mmat.dtype)
+    qk[:] = q0
+    qnext = np.empty_like(qk)
+    ck = np.empty_like(qk)
+    impact = np.zeros(nsamples, dtype=mmat.dtype)
+    for k in range(1, nt):
+        np.matmul(qk, mmat.T, out=qnext)
+        active = (tlo <= k) & (k <= thi)
+        if active.any():
+            ck.fill(0.0)
+            ck[sample[active], index[active]] = value[active]
+            qnext += ck @ kmat.T
+        np.minimum(qnext, 1.0, out=qnext) # upper limit (fix roundoff errors)
+        qk, qnext = qnext, qk
+        impact += (0.5 if k == nt - 1 else 1.0) * qk.sum(axis=1)
+    return impact
+
+
+def _step_matrix(astar, kmat):
+    # Return the constant DIIM time step matrix M = K A* + I - K.
+    return kmat @ astar + (np.identity(len(astar), dtype=astar.dtype) - kmat)
+
+
 class DIIM:
     """Class providing the Dynamic Inoperability Input-Output Model."""
 
@@ -63,11 +127,12 @@ class DIIM:
             "lambda": 0.01,  # q(tau) value
             "time_steps": 0,  # number of time steps
             "map_scale": "5-point", # mapping consequences to A* matrix
-            "datafile": None,  # file with interdependency matrix etc.
+            "datafile": None,  # file (or pd.ExcelFile) with A* matrix etc.
             "amat_sheet_name": "A_matrix",  # name of Excel sheet with A* matrix
             "tau_sheet_name": None, # name of Excel sheet with tau values
             "kmat_sheet_name": None, # name of Excel sheet with K matrix
             "q0_sheet_name": None, # name of Excel sheet with q(0) values
+            "dtype": "float64", # floating-point type of model matrices
         }
         self.config.update(config["DIIM"])
         self.infra = [] 
@@ -77,16 +142,34 @@ class DIIM:
         self.astar = None
         self.smat = None
         self.q0 = None
+        self.__lu = None
+        self.__xlsx = None
         self.__tau = None
         self.__kmat = None
         self.__KMAT_MAX = 0.9999 # k[i] = [0, 1)
+        self.__SAMPLE_CHUNK = 256 # samples per batch in sampling_impact
 
-        self._read_io_table()
-        self._calc_leontief_coefficients()
-        self._calc_interdependency_matrix()
-        self._init_tau_values()
-        self._init_k_matrix()
-        self._init_q0()
+        # Note:
+        #   The datafile is opened once and all sheets are read from the
+        #   same handle. A pd.ExcelFile passed as datafile is used as is and
+        #   left open.
+        datafile = self.config["datafile"]
+        if isinstance(datafile, pd.ExcelFile):
+            self.__xlsx = datafile
+        else:
+            self.__xlsx = pd.ExcelFile(datafile)
+        try:
+            self._read_io_table()
+            self._calc_leontief_coefficients()
+            self._calc_interdependency_matrix()
+            self._init_tau_values()
+            self._init_k_matrix()
+            self._init_q0()
+            self._set_dtype()
+        finally:
+            if self.__xlsx is not datafile:
+                self.__xlsx.close()
+            self.__xlsx = None
 
         self.perturb = Perturbation(config, self.infra)
 
@@ -102,7 +185,7 @@ class DIIM:
             total outputs.
         """
         df = pd.read_excel(
-            self.config["datafile"], sheet_name=self.config["amat_sheet_name"]
+            self.__xlsx, sheet_name=self.config["amat_sheet_name"]
         )
         self.infra = df.columns.tolist()
         io_tmp = df.to_numpy()
@@ -127,10 +210,8 @@ class DIIM:
         n = self.__len__()
         self.amat = np.zeros(shape=(n, n)) 
         if self.config["matrix_type"] == "input-output":
-            for i in range(n):
-                for j in range(n):
-                    if self.xoutput[j] != 0:
-                        self.amat[i, j] = self.io_table[i, j] / self.xoutput[j]
+            xsafe = np.where(self.xoutput == 0, 1.0, self.xoutput)
+            self.amat = np.where(self.xoutput == 0, 0.0, self.io_table / xsafe)
 
     def _calc_interdependency_matrix(self):
         # Calculate demand-driven or supply-driven interdependency matrix
@@ -153,16 +234,21 @@ class DIIM:
                 #   self.astar = np.matmul(self.amat, pmat)
                 #   self.astar = np.matmul(pinv, self.astar)
                 # may create singular matrix if x_i == 0.
-                for i in range(n):
-                    for j in range(n):
-                        if self.xoutput[j] != 0:
-                            self.astar[i, j] = self.io_table[i, j] / self.xoutput[j]
+                xsafe = np.where(self.xoutput == 0, 1.0, self.xoutput)
+                self.astar = np.where(self.xoutput == 0, 0.0, self.io_table / xsafe)
         elif self.config["matrix_type"] == "consequence":
             self.astar = map_to_interdep(self.io_table, self.config["map_scale"])
         else: # interdependency matrix provided
             self.astar = self.io_table
         self._check_stability()
-        self.smat = np.linalg.inv(np.identity(n) - self.astar)
+        # Note:
+        #   LAPACK works on column-major arrays. I - A* is built directly in
+        #   Fortran order and factorized in place, so lu_factor does not make
+        #   a transposed copy of it.
+        imat = np.eye(n, order="F")
+        imat -= self.astar
+        self.__lu = lu_factor(imat, overwrite_a=True)
+        self.smat = lu_solve(self.__lu, np.identity(n))
 
     def _check_stability(self):
         # Check if the dominant eigenvalue of matrix A* is smaller in absolute
@@ -171,10 +257,11 @@ class DIIM:
         # Reference:
         #   Setola et al. (2009), eq. 6.
         #
-        evals, _ = np.linalg.eig(self.astar)
-        idx = evals.argsort()[::-1] # ascending order
-        evals = evals[idx]
-        lambda_0 = np.abs(np.real(evals.max()))
+        # Note:
+        #   Eigenvectors are not needed, only the eigenvalues are computed.
+        #
+        evals = np.linalg.eigvals(self.astar)
+        lambda_0 = np.abs(evals).max()
         if lambda_0 >= 1:
             raise Exception("A* is not stable, dominant eigenvalue is " + str(lambda_0))
 
@@ -182,7 +269,7 @@ class DIIM:
         # Initialize tau values by reading from xlsx file.
         if self.config["tau_sheet_name"]:
             df = pd.read_excel(
-                self.config["datafile"], sheet_name=self.config["tau_sheet_name"]
+                self.__xlsx, sheet_name=self.config["tau_sheet_name"]
             )
             self.__tau = df.to_numpy()[0]
         else:
@@ -193,7 +280,7 @@ class DIIM:
         # no file is provided.
         if self.config["kmat_sheet_name"]:
             df = pd.read_excel(
-                self.config["datafile"], sheet_name=self.config["kmat_sheet_name"]
+                self.__xlsx, sheet_name=self.config["kmat_sheet_name"]
             )
             self.__kmat = df.to_numpy()
             # fix bad input values
@@ -222,7 +309,7 @@ class DIIM:
         # if no file is provided.
         if self.config["q0_sheet_name"]:
             df = pd.read_excel(
-                self.config["datafile"], sheet_name=self.config["q0_sheet_name"]
+                self.__xlsx, sheet_name=self.config["q0_sheet_name"]
             )
             self.q0 = df.to_numpy()[0]
             if len(self.q0) != self.__len__():
@@ -233,9 +320,47 @@ class DIIM:
         else:
             self.q0 = np.zeros(self.__len__())
 
+    def _set_dtype(self):
+        # Store model matrices as contiguous arrays of the configured
+        # floating-point type. Single precision halves the memory traffic
+        # of the matrix products in the dynamic models.
+        dtype = np.dtype(self.config["dtype"])
+        if not np.issubdtype(dtype, np.floating):
+            raise Exception("bad dtype: " + str(self.config["dtype"]))
+        self.astar = np.ascontiguousarray(self.astar, dtype=dtype)
+        self.smat = np.ascontiguousarray(self.smat, dtype=dtype)
+        self.q0 = np.ascontiguousarray(self.q0, dtype=dtype)
+        self.__kmat = np.ascontiguousarray(self.__kmat, dtype=dtype)
+
     def set_perturbation(self, pinfra, ptime=None, cvalue=None):
         self.perturb.set_perturbation(pinfra, ptime, cvalue)
 
+    def sampling_impact(self, samples, ptime=None, cvalue=None):
+        """Calculate the total dynamic impact of each perturbed set of
+        infrastructures in samples."""
+        nt = self.config["time_steps"]
+        if self.config["time_steps"] == 0:
+            nt = 1
+        # Note:
+        #   Samples are integrated in chunks to bound the memory used by
+        #   large samplings (n(n - 1) samples in hybrid_attack_sampling).
+        #
+        impact = np.zeros(len(samples), dtype=self.astar.dtype)
+        for start in range(0, len(samples), self.__SAMPLE_CHUNK):
+            chunk = samples[start:start + self.__SAMPLE_CHUNK]
+            terms = []
+            for p, pinfra in enumerate(chunk):
+                self.set_perturbation(pinfra=pinfra, ptime=ptime, cvalue=cvalue)
+                index, ptimes, cvalues = self.perturb.cstar_terms()
+                sample = np.full(len(index), p)
+                terms.append((sample, index, ptimes[:, 0], ptimes[:, 1], cvalues))
+            terms = [np.concatenate(items) for items in zip(*terms)]
+            terms[4] = terms[4].astype(self.astar.dtype, copy=False)
+            impact[start:start + len(chunk)] = _diim_step_batch(
+                self.astar, self.__kmat, self.q0, terms, len(chunk), nt
+            )
+        return impact
+
     def dependency(self):
         """Calculate dependency index."""
         #
@@ -247,14 +372,7 @@ class DIIM:
         #
         if self.config["mode"] == "demand":
             n = self.__len__()
-            delta = np.zeros(n)
-            for i in range(n):
-                di = 0.0
-                for j in range(n):
-                    if j != i:
-                        di += self.astar[i, j]
-                delta[i] = di
-            return delta / (n - 1.0)
+            return (self.astar.sum(axis=1) - np.diagonal(self.astar)) / (n - 1.0)
         else:
             return None
 
@@ -269,14 +387,7 @@ class DIIM:
         #
         if self.config["mode"] == "demand":
             n = self.__len__()
-            rho = np.zeros(n)
-            for j in range(n):
-                rj = 0.0
-                for i in range(n):
-                    if i != j:
-                        rj += self.astar[i, j]
-                rho[j] = rj
-            return rho / (n - 1.0)
+            return (self.astar.sum(axis=0) - np.diagonal(self.astar)) / (n - 1.0)
         else:
             return None
 
@@ -291,14 +402,7 @@ class DIIM:
         #
         if self.config["mode"] == "demand":
             n = self.__len__()
-            delta = np.zeros(n)
-            for i in range(n):
-                di = 0.0
-                for j in range(n):
-                    if j != i:
-                        di += self.smat[i, j]
-                delta[i] = di
-            return delta / (n - 1.0)
+            return (self.smat.sum(axis=1) - np.diagonal(self.smat)) / (n - 1.0)
         else:
             return None
 
@@ -313,17 +417,20 @@ class DIIM:
         #
         if self.config["mode"] == "demand":
             n = self.__len__()
-            rho = np.zeros(n)
-            for j in range(n):
-                rj = 0.0
-                for i in range(n):
-                    if i != j:
-                        rj += self.smat[i, j]
-                rho[j] = rj
-            return rho / (n - 1.0)
+            return (self.smat.sum(axis=0) - np.diagonal(self.smat)) / (n - 1.0)
         else:
             return None
 
+    def _indices(self):
+        # Return dependency, overall dependency, influence gain and overall
+        # influence gain (None if not in demand mode).
+        return (
+            self.dependency(),
+            self.overall_dependency(),
+            self.influence(),
+            self.overall_influence(),
+        )
+
     def interdependency_index(self, isector, jsector, order=1):
         """Return n-th order interdependency index between two infrastructures."""
         try:
@@ -337,14 +444,22 @@ class DIIM:
     def max_nth_order_interdependency(self, n=1):
         """Return maximum nth-order interdependency index for each sector."""
         assert n >= 1
-        amat = np.linalg.matrix_power(self.astar, n)
-        res = []
-        for i in range(self.__len__()):
-            j = np.argmax(amat[i, :], axis=0)
-            tmp = [self.infra[i], self.infra[j], amat[i, j]]
-            res.append(tmp)
+        return self._max_row(self._powers(n)[-1])
+
+    def _powers(self, kmax):
+        # Return the matrix powers A*, A*^2, ..., A*^kmax.
+        res = [self.astar]
+        for _ in range(kmax - 1):
+            res.append(res[-1] @ self.astar)
         return res
 
+    def _max_row(self, amat):
+        # Return the largest element in each row of amat together with the
+        # corresponding row and column infrastructures.
+        j = amat.argmax(axis=1)
+        amax = amat[np.arange(len(j)), j]
+        return [[self.infra[i], self.infra[jj], amax[i]] for i, jj in enumerate(j)]
+
     def inoperability(self):
         """Calculate inoperability for the infrastructure functions at
         equilibrium."""
@@ -353,7 +468,7 @@ class DIIM:
         #   Haimes & Jiang (2001), eq. 14.
         #   Haimes et al. (2005), eq. 38.
         #
-        q = np.matmul(self.smat, self.perturb.cstar())
+        q = lu_solve(self.__lu, self.perturb.cstar())
         q[q > 1.0] = 1.0 # fix roundoff errors
         return q
 
@@ -365,25 +480,11 @@ class DIIM:
         #   Haimes et al. (2005), eq. 51.
         #   Lian & Haimes (2006), eq. 21.
         #
-        n = self.__len__()
         nt = self.config["time_steps"]
         if self.config["time_steps"] == 0:
             nt = 1
-        qt = np.zeros(shape=(nt, n + 1))
-        qk = self.q0
-
-        for k in range(1, self.config["time_steps"]):
-            qk = (
-                np.matmul(
-                    self.__kmat,
-                    (np.matmul(self.astar, qk) + self.perturb.cstar(k) - qk),
-                )
-                + qk
-            )
-            qk[qk > 1.0] = 1.0 # upper limit (fix roundoff errors)
-            qt[k, 0] = k
-            qt[k, 1:] = qk
-        return qt
+        cstar = self.perturb.cstar_matrix(nt).astype(self.astar.dtype, copy=False)
+        return _diim_step(self.astar, self.__kmat, self.q0, cstar, nt)
 
     def dynamic_recovery(self):
         """Calculate the dynamic recovery of the infrastructure sectors."""
@@ -396,19 +497,24 @@ class DIIM:
         if self.config["time_steps"] == 0:
             nt = 1
 
-        qt = np.zeros((nt, n + 1))
-        qk = np.zeros(n)
+        qt = np.zeros((nt, n + 1), dtype=self.astar.dtype)
         tmp = np.matmul(self.__kmat, np.identity(n) - self.astar)
-        for k in range(1, self.config["time_steps"]):
-            qk = np.matmul(expm(-tmp * k), self.q0)
-            qk[qk < 0.0] = 0.0  # lower limit (fix roundoff errors)
+        #
+        # Note:
+        #   q(k) = exp(-tmp k) q(0) is evaluated by stepping with the
+        #   constant matrix E = exp(-tmp), q(k) = E q(k - 1). This needs a
+        #   single matrix exponential, and unlike an eigendecomposition it
+        #   is also valid when tmp is not diagonalizable.
+        #
+        emat = expm(-tmp).astype(self.astar.dtype, copy=False)
+        qk = self.q0
+        for k in range(1, nt):
+            qk = np.matmul(emat, qk)
             qt[k, 0] = k
             qt[k, 1:] = qk
+        qt[qt < 0.0] = 0.0  # lower limit (fix roundoff errors)
         return qt
 
     def impact(self, qt):
         """Compute impact by integrating q(t)."""
-        qtot = []
-        for j in range(1, np.size(qt, 1)):
-            qtot.append(trapezoid(qt[:, j]))
-        return np.array(qtot)
+        return trapezoid(qt[:, 1:], axis=0)
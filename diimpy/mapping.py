@@ -6,7 +6,7 @@
 
 import numpy as np
 
-def _map_to_interdep(consequence, scale):
+def map_to_interdep(consequence, scale="5-point"):
     """Mapping of consequences to interdependency values."""
     #
     # Algorithm:
@@ -32,6 +32,6 @@ def _map_to_interdep(consequence, scale):
     if scale == "4-point":
         a = 0.01
         b = 2.821928095
-    return a * np.power(consequence, b)
-
-map_to_interdep = np.vectorize(_map_to_interdep)
+    res = np.power(np.asarray(consequence, dtype=np.float64), b)
+    res *= a # scale in place to avoid a second n x n temporary
+    return res
@@ -17,7 +17,8 @@ class Perturbation:
 
     def __init__(self, config, infra):
         self.__infra = infra
-        self.__pindex = []
+        self.__index = {name: i for i, name in enumerate(infra)}
+        self.__pindex = np.array([], dtype=int)
         self.config = {
             "pinfra": [],
             "cvalue": [],
@@ -32,13 +33,18 @@ class Perturbation:
     def _init_perturbation(self):
         self.c0 = np.zeros(len(self.__infra))
         if self.config["pinfra"]:
-            self.__pindex = []
-            for item in self.config["pinfra"]:
-                self.__pindex.append(self.__infra.index(item))
+            self.__pindex = np.array(
+                [self.__index[item] for item in self.config["pinfra"]], dtype=int
+            )
         if "ptime" not in self.config:
             self.config["ptime"] = []
             for _ in self.config["pinfra"]:
                 self.config["ptime"].append([0, 0])
+        if (
+            len(self.config["ptime"]) != len(self.config["pinfra"])
+            or len(self.config["cvalue"]) != len(self.config["pinfra"])
+        ):
+            raise Exception("bad sizes")
 
     def set_perturbation(self, pinfra, ptime=None, cvalue=None):
         self.config["pinfra"] = pinfra
@@ -50,7 +56,7 @@ class Perturbation:
 
     def cstar(self, time=0):
         """Return perturbation c*(t)."""
-        ct = self.c0
+        ct = self.c0.copy()
         for i, _ in enumerate(self.config["ptime"]):
             if (
                 time >= self.config["ptime"][i][0]
@@ -58,3 +64,17 @@ class Perturbation:
             ):
                 ct[self.__pindex[i]] = self.config["cvalue"][i]
         return ct
+
+    def cstar_matrix(self, nt):
+        """Return perturbations c*(t) for time steps 0, ..., nt - 1."""
+        ct = np.zeros(shape=(nt, len(self.__infra)))
+        for i, (lo, hi) in enumerate(self.config["ptime"]):
+            ct[lo:hi + 1, self.__pindex[i]] = self.config["cvalue"][i]
+        return ct
+
+    def cstar_terms(self):
+        """Return indices, time windows [t0, t1] and values of the
+        perturbations."""
+        ptime = np.array(self.config["ptime"], dtype=int).reshape(-1, 2)
+        cvalue = np.array(self.config["cvalue"], dtype=np.float64)
+        return self.__pindex, ptime, cvalue
@@ -4,10 +4,123 @@
 # LICENSE.txt or http://www.opensource.org/licenses/mit-license.php for terms
 # and conditions.
 
+import os
+import sys
+from functools import lru_cache
+
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
-from matplotlib.ticker import AutoLocator, AutoMinorLocator
+import pandas as pd
+
+# Note:
+#   matplotlib is imported inside the functions that use it (pyplot through
+#   _pyplot), so importing diimpy does not pay the cost of loading pyplot
+#   and its backend.
+
+
+def _pyplot():
+    # Import and return pyplot.
+    #
+    # Note:
+    #   Without a display, and unless a backend has been chosen (Jupyter
+    #   kernels set MPLBACKEND to the inline backend), the non-interactive
+    #   Agg backend is selected before pyplot is first imported.
+    #
+    if "matplotlib.pyplot" not in sys.modules:
+        import matplotlib
+        headless = sys.platform.startswith("linux") and not (
+            os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY")
+        )
+        if headless and not os.environ.get("MPLBACKEND"):
+            matplotlib.use("Agg", force=False)
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def pooled_axes(figsize=None, dpi=100):
+    """Return empty axes on a pooled figure for reuse with ax=.
+
+    Figures are pooled by figsize and dpi, so batch plotting reuses their
+    canvases instead of creating a new figure per plot. Axes returned
+    earlier from the same pool entry are cleared.
+    """
+    fig = _pooled_figure(None if figsize is None else tuple(figsize), dpi)
+    fig.clear()
+    return fig.subplots()
+
+
+@lru_cache(maxsize=8)
+def _pooled_figure(figsize, dpi):
+    # Create a figure for the figure pool used by pooled_axes.
+    #
+    # Note:
+    #   Pooled figures are not registered with pyplot, so a figure evicted
+    #   from the pool is freed and is never shown by plt.show().
+    #
+    from matplotlib.figure import Figure
+    return Figure(figsize=figsize, dpi=dpi, layout="constrained")
+
+
+@lru_cache(maxsize=64)
+def _nipy_palette(n):
+    # Return n colours evenly spaced over the nipy_spectral colormap. The
+    # array is cached per n and shared, so it is made read-only.
+    plt = _pyplot()
+    colors = plt.get_cmap("nipy_spectral")(np.linspace(0, 1, n))
+    colors.flags.writeable = False
+    return colors
+
+
+def _get_axes(ax, **kwargs):
+    # Return ax, or new axes on a new figure if ax is None, and whether a
+    # new figure was created.
+    if ax is None:
+        _, ax = _pyplot().subplots(layout="constrained", **kwargs)
+        return ax, True
+    return ax, False
+
+
+def _save(ax, filename, dpi, close):
+    # Save the figure of ax to file at the given (print) resolution.
+    # Figures created by the helpers are closed after saving to release
+    # their canvas.
+    if filename:
+        ax.figure.savefig(filename, dpi=dpi)
+        if close:
+            _pyplot().close(ax.figure)
+
+
+def _legend_below(ax, handles, ncol=5):
+    # Add a legend below the plot, with at most ncol columns and no more
+    # than fit in the width of the figure.
+    #
+    # Note:
+    #   On a constrained layout figure with a single axes, the legend is
+    #   placed "outside lower center" of the figure, so that the layout
+    #   engine reserves space for it. Otherwise it is anchored below ax.
+    #   The width of a legend does not depend on the layout, so the number
+    #   of columns is chosen before the figure is rendered.
+    #
+    from matplotlib.layout_engine import ConstrainedLayoutEngine
+
+    fig = ax.figure
+    constrained = isinstance(fig.get_layout_engine(), ConstrainedLayoutEngine)
+    while True:
+        if constrained and len(fig.axes) == 1:
+            legend = fig.legend(
+                handles=handles, loc="outside lower center", ncols=ncol
+            )
+        else:
+            legend = ax.legend(
+                handles=handles,
+                loc="upper center",
+                bbox_to_anchor=(0.5, -0.15),
+                ncols=ncol,
+            )
+        if ncol == 1 or legend.get_window_extent().width <= fig.bbox.width:
+            break
+        legend.remove()
+        ncol -= 1
+    return legend
 
 
 def bar_plot(
@@ -17,20 +130,36 @@ def bar_plot(
     ylabel=None,
     title=None,
     figsize=(10, 5),
-    dpi=300,
+    dpi=100,
+    save_dpi=300,
     filename=None,
+    ax=None,
 ):
     """Helper function for creating IIM plots."""
-    _, ax = plt.subplots(figsize=figsize, dpi=dpi)
-    ax.bar(xdata, ydata)
+    from matplotlib.collections import PatchCollection
+    from matplotlib.patches import Rectangle
+
+    ax, new_figure = _get_axes(ax, figsize=figsize, dpi=dpi)
+    ax.tick_params(axis="x", labelrotation=90)
+
+    # Draw all bars as a single artist:
+    x_pos = np.arange(len(xdata))
+    bars = PatchCollection(
+        [Rectangle((x - 0.4, 0.0), 0.8, y) for x, y in zip(x_pos, ydata)],
+        facecolor="C0",
+    )
+    bars.sticky_edges.y.append(0.0)
+    ax.add_collection(bars)
+    ax.autoscale_view()
+    ax.set_xticks(x_pos)
+    ax.set_xticklabels(xdata)
     ax.yaxis.grid(color='gray', linestyle='dashed')
     ax.set_ylabel(ylabel)
     ax.set_xlabel(xlabel)
     ax.set_title(title)
-    plt.xticks(rotation=90)
 
-    if filename:
-        plt.savefig(filename, dpi=dpi, bbox_inches="tight")
+    _save(ax, filename, save_dpi, new_figure)
+    return ax
 
 
 def grouped_bar_plot(
@@ -42,31 +171,33 @@ def grouped_bar_plot(
     title=None,
     bar_width=0.4,
     figsize=(10, 5),
-    dpi=300,
+    dpi=100,
+    save_dpi=300,
     filename=None,
+    ax=None,
 ):
     """Helper function for creating grouped IIM bar plots."""
-    _, ax = plt.subplots(figsize=figsize, dpi=dpi)
+    ax, new_figure = _get_axes(ax, figsize=figsize, dpi=dpi)
     ax.yaxis.grid(color='gray', linestyle='dashed')
+    ax.tick_params(axis="x", labelrotation=90)
 
     x_pos = np.arange(len(xtick_labels))
 
-    # Loop over data:
-    for i, (group, values) in enumerate(data.items()):
-        pos = x_pos + (i * bar_width)
-        ax.bar(pos, values, width=bar_width, label=group)
+    # Bar positions of all groups, shape (n_groups, n_xticks):
+    pos = x_pos + (np.arange(len(data)) * bar_width)[:, np.newaxis]
+    for group_pos, (group, values) in zip(pos, data.items()):
+        ax.bar(group_pos, values, width=bar_width, label=group)
 
     ax.set_xticks(x_pos + ((len(data) - 1) / 2) * bar_width)
     ax.set_xticklabels(xtick_labels)
-    plt.xticks(rotation=90)
 
     ax.legend(legend)
     ax.set_ylabel(ylabel)
     ax.set_xlabel(xlabel)
     ax.set_title(title)
 
-    if filename:
-        plt.savefig(filename, dpi=dpi, bbox_inches="tight")
+    _save(ax, filename, save_dpi, new_figure)
+    return ax
 
 
 def plot_dynamic(
@@ -77,24 +208,36 @@ def plot_dynamic(
     ylabel="Inoperability",
     title=None,
     figsize=(9, 5),
-    dpi=300,
+    dpi=100,
+    save_dpi=300,
     filename=None,
+    ax=None,
 ):
     """Helper function for plotting dynamic IIM data."""
+    from matplotlib.collections import LineCollection
+    from matplotlib.lines import Line2D
+    from matplotlib.ticker import AutoLocator, AutoMinorLocator
+
     labels = data.columns[1:]
-    t_data = data.to_numpy()[:, 0]
-    q_data = data.to_numpy()[:, 1:]
+    t_data = data.iloc[:, 0].to_numpy(copy=False)
+    q_data = data.iloc[:, 1:].to_numpy(copy=False)
 
-    _, ax = plt.subplots(figsize=figsize, dpi=dpi)
-    colors = plt.cm.nipy_spectral(np.linspace(0, 1, len(labels)))
-    ax.set_prop_cycle("color", colors)
+    ax, new_figure = _get_axes(ax, figsize=figsize, dpi=dpi)
+    colors = _nipy_palette(len(labels))
 
-    for j in range(len(labels)):
-        ax.plot(t_data, q_data[:, j], label=labels[j], linestyle="-", linewidth=2)
+    # Draw all curves as a single artist, segments of shape (n_lines, n_t, 2):
+    segments = np.stack(
+        [np.broadcast_to(t_data, q_data.T.shape), q_data.T], axis=-1
+    )
+    lines = LineCollection(
+        segments, colors=colors, linestyle="-", linewidths=2, rasterized=True
+    )
+    ax.add_collection(lines)
+    ax.autoscale_view()
 
     if ylim:
         ax.set_ylim(ylim)
-    plt.yscale(yscale)
+    ax.set_yscale(yscale)
 
     ax.yaxis.grid(color='gray', linestyle='dashed')
 
@@ -104,10 +247,14 @@ def plot_dynamic(
     ax.set_ylabel(ylabel)
     ax.set_xlabel(xlabel)
     ax.set_title(title)
-    ax.legend(loc="upper center", bbox_to_anchor=(0.5, -0.15), ncol=5)
+    handles = [
+        Line2D([], [], color=color, linestyle="-", linewidth=2, label=label)
+        for color, label in zip(colors, labels)
+    ]
+    _legend_below(ax, handles)
 
-    if filename:
-        plt.savefig(filename, dpi=dpi, bbox_inches="tight")
+    _save(ax, filename, save_dpi, new_figure)
+    return ax
 
 
 def plot_heatmap(
@@ -118,18 +265,35 @@ def plot_heatmap(
     ylabel=None,
     title=None,
     cbar_label="Impact",
-    dpi=300,
+    cmap="magma",
+    dpi=100,
+    save_dpi=300,
     filename=None,
+    ax=None,
 ):
     """Helper function for creating heatmaps."""
-    data = df.pivot(index="infra_i", columns="infra_j", values="impact")
-    _, ax = plt.subplots(dpi=dpi)
-    sns.heatmap(
-        data, linewidth=0.5, vmin=vmin, vmax=vmax, cbar_kws={"label": cbar_label}, ax=ax
+    i_idx, i_labels = pd.factorize(df["infra_i"], sort=True)
+    j_idx, j_labels = pd.factorize(df["infra_j"], sort=True)
+    data = np.full((len(i_labels), len(j_labels)), np.nan)
+    data[i_idx, j_idx] = df["impact"].to_numpy(copy=False)
+    ax, new_figure = _get_axes(ax, dpi=dpi)
+    ax.tick_params(axis="x", labelrotation=90)
+    image = ax.imshow(
+        data,
+        cmap=cmap,
+        vmin=vmin,
+        vmax=vmax,
+        aspect="auto",
+        interpolation="nearest",
     )
+    ax.figure.colorbar(image, ax=ax, label=cbar_label)
+    ax.set_xticks(np.arange(len(j_labels)))
+    ax.set_xticklabels(j_labels)
+    ax.set_yticks(np.arange(len(i_labels)))
+    ax.set_yticklabels(i_labels)
     ax.set_xlabel(xlabel)
     ax.set_ylabel(ylabel)
     ax.set_title(title)
 
-    if filename:
-        plt.savefig(filename, dpi=dpi, bbox_inches="tight")
+    _save(ax, filename, save_dpi, new_figure)
+    return ax
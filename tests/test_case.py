@@ -4,13 +4,31 @@
 # LICENSE.txt or http://www.opensource.org/licenses/mit-license.php for terms
 # and conditions.
 
+import copy
 import os
+import shutil
+import tempfile
 import unittest
 import numpy as np
+import pandas as pd
+import diimpy.analyze as dpa
 import diimpy.diim as dpd
+import diimpy.plot as dpp
 
 class TestDIIM(unittest.TestCase):
 
+    @classmethod
+    def setUpClass(cls):
+        cls._models = {}
+
+    def _model(self, config):
+        # Models are built once per configuration. Each test gets a copy,
+        # so that changing the perturbation does not affect other tests.
+        key = repr(config)
+        if key not in self._models:
+            self._models[key] = dpd.DIIM(config)
+        return copy.deepcopy(self._models[key])
+
     def test_case1(self):
         # Correct answer (Haimes & Jiang, 2001):
         # --------------------------------------
@@ -29,10 +47,10 @@ class TestDIIM(unittest.TestCase):
                 "cvalue": [0.6] 
             }
         }
-        model = dpd.DIIM(config)
+        model = self._model(config)
         q = model.inoperability()
 
-        self.assertTrue(np.allclose(q, qans, atol=0.001))
+        np.testing.assert_allclose(q, qans, atol=0.001)
 
     def test_case2(self):
         # Correct answer (Haimes & Jiang, 2001):
@@ -52,10 +70,10 @@ class TestDIIM(unittest.TestCase):
                 "cvalue": [0.5] 
             }
         }
-        model = dpd.DIIM(config)
+        model = self._model(config)
         q = model.inoperability()
 
-        self.assertTrue(np.allclose(q, qans, atol=0.01))
+        np.testing.assert_allclose(q, qans, atol=0.01)
 
     def test_case3(self):
         # Correct answer:
@@ -75,10 +93,10 @@ class TestDIIM(unittest.TestCase):
                 "cvalue": [0.12] 
             }
         }
-        model = dpd.DIIM(config)
+        model = self._model(config)
         q = model.inoperability()
 
-        self.assertTrue(np.allclose(q, qans, atol=0.01))
+        np.testing.assert_allclose(q, qans, atol=0.01)
 
     def test_case4(self):
         # Correct answer:
@@ -102,8 +120,8 @@ class TestDIIM(unittest.TestCase):
                 "cvalue": [0.0] 
             }
         }
-        model = dpd.DIIM(config)
-        self.assertTrue(np.allclose(a_ans, model.amat, atol=0.015))
+        model = self._model(config)
+        np.testing.assert_allclose(model.amat, a_ans, atol=0.015)
 
     def test_case5(self):
         # Correct answer:
@@ -127,8 +145,8 @@ class TestDIIM(unittest.TestCase):
                 "cvalue": [0.0] 
             }
         }
-        model = dpd.DIIM(config)
-        self.assertTrue(np.allclose(a_ans, model.astar, atol=0.015))
+        model = self._model(config)
+        np.testing.assert_allclose(model.astar, a_ans, atol=0.015)
 
     def test_case6(self):
         # Correct answer:
@@ -148,10 +166,10 @@ class TestDIIM(unittest.TestCase):
                 "cvalue": [0.1] 
             }
         }
-        model = dpd.DIIM(config)
+        model = self._model(config)
         q = model.inoperability()
 
-        self.assertTrue(np.allclose(q_ans, q, atol=0.001))
+        np.testing.assert_allclose(q, q_ans, atol=0.001)
 
     def test_case7(self):
         # Numpy calculations:
@@ -170,20 +188,20 @@ class TestDIIM(unittest.TestCase):
                 "datafile": fname,
             },
         }
-        model = dpd.DIIM(config)
+        model = self._model(config)
         res1 = model.interdependency_index("Sector3", "Sector2", 2)
         res2 = model.interdependency_index("Sector3", "Sector2", 3)
         res3 = model.interdependency_index("Sector1", "Sector2", 3)
         res4 = model.interdependency_index("Sector4", "Sector4", 3)
 
-        self.assertTrue(np.allclose(ans1, res1, atol=0.001))
-        self.assertTrue(np.allclose(ans2, res2, atol=0.001))
-        self.assertTrue(np.allclose(ans3, res3, atol=0.001))
-        self.assertTrue(np.allclose(ans4, res4, atol=0.001))
+        np.testing.assert_allclose(res1, ans1, atol=0.001)
+        np.testing.assert_allclose(res2, ans2, atol=0.001)
+        np.testing.assert_allclose(res3, ans3, atol=0.001)
+        np.testing.assert_allclose(res4, ans4, atol=0.001)
 
         res_max = model.max_nth_order_interdependency(3)
         res_max = [row[2] for row in res_max[:]]
-        self.assertTrue(np.allclose(ans_max, res_max, atol=0.001))
+        np.testing.assert_allclose(res_max, ans_max, atol=0.001)
 
     def test_case8(self):
         # Correct answer:
@@ -206,10 +224,10 @@ class TestDIIM(unittest.TestCase):
                 "cvalue": [0.1],
             }
         }
-        model = dpd.DIIM(config)
+        model = self._model(config)
         qt = model.dynamic_inoperability()
 
-        self.assertTrue(np.allclose(q_ans, qt[-1, 1:], atol=0.001))
+        np.testing.assert_allclose(qt[-1, 1:], q_ans, atol=0.001)
 
     def test_case9(self):
         qans = [0.0, 0.0]
@@ -240,14 +258,14 @@ class TestDIIM(unittest.TestCase):
                 "cvalue": [0.1],
             }
         }
-        model = dpd.DIIM(config)
+        model = self._model(config)
         qt = model.dynamic_recovery()
 
-        self.assertTrue(np.allclose(qans, qt[-1, 1:], atol=0.001))
+        np.testing.assert_allclose(qt[-1, 1:], qans, atol=0.001)
 
     def test_case10(self):
-        # Integrated using Numpy:
-        qtot_ans = [5.78342065, 10.49188014]
+        # Integrated using Numpy (perturbation applied for t = 0, ..., 30):
+        qtot_ans = [1.98014429, 3.36631738]
 
         fname = os.path.join("tests", "test_case10.xlsx")
         config = {
@@ -264,11 +282,11 @@ class TestDIIM(unittest.TestCase):
                 "ptime": [[0, 30]],
             },
         }
-        model = dpd.DIIM(config)
+        model = self._model(config)
         qt = model.dynamic_inoperability()
         qtot = model.impact(qt)
 
-        self.assertTrue(np.allclose(qtot_ans, qtot, atol=0.001))
+        np.testing.assert_allclose(qtot, qtot_ans, atol=0.001)
 
     def test_case11(self):
         # Correct answer:
@@ -292,5 +310,202 @@ class TestDIIM(unittest.TestCase):
                 "cvalue": [0.0] 
             }
         }
-        model = dpd.DIIM(config)
-        self.assertTrue(np.allclose(a_ans, model.astar, atol=0.0001))
+        model = self._model(config)
+        np.testing.assert_allclose(model.astar, a_ans, atol=0.0001)
+
+    def test_case12(self):
+        # Triangular A* and K = I (K(I - A*) is not diagonalizable).
+        # Computed with scipy.linalg.expm, q(5) = exp(-5 (I - A*)) q(0):
+        qans = [0.02358281, 0.01010692, 0.00336897]
+
+        fname = os.path.join("tests", "test_case12.xlsx")
+        config = {
+            "DIIM": {
+                "matrix_type": "interdependency",
+                "mode": "demand",
+                "time_steps": 11,
+                "datafile": fname,
+                "q0_sheet_name": "q0_data"
+            },
+            "Perturbation": {
+                "pinfra": ["Sector1"],
+                "cvalue": [0.0],
+            }
+        }
+        model = self._model(config)
+        qt = model.dynamic_recovery()
+
+        np.testing.assert_allclose(qt[5, 1:], qans, atol=1.0e-6)
+
+    def test_cstar_matrix(self):
+        fname = os.path.join("tests", "test_case10.xlsx")
+        config = {
+            "DIIM": {
+                "matrix_type": "interdependency",
+                "datafile": fname,
+                "amat_sheet_name": "A_matrix",
+                "kmat_sheet_name": "K_matrix",
+                "time_steps": 100,
+            },
+            "Perturbation": {
+                "pinfra": ["Sector2"],
+                "cvalue": [0.1],
+                "ptime": [[0, 30]],
+            },
+        }
+        model = self._model(config)
+        cmat = model.perturb.cstar_matrix(100)
+        cans = [model.perturb.cstar(k) for k in range(100)]
+
+        np.testing.assert_allclose(cmat, cans)
+        np.testing.assert_allclose(model.perturb.cstar(31), [0.0, 0.0])
+
+        # ptime and cvalue must match pinfra:
+        with self.assertRaises(Exception):
+            model.set_perturbation(["Sector1"], ptime=[[0, 30], [0, 40]])
+
+    def test_sampling_impact(self):
+        fname = os.path.join("tests", "test_case10.xlsx")
+        config = {
+            "DIIM": {
+                "matrix_type": "interdependency",
+                "datafile": fname,
+                "amat_sheet_name": "A_matrix",
+                "kmat_sheet_name": "K_matrix",
+                "time_steps": 100,
+            },
+            "Perturbation": {
+                "pinfra": ["Sector2"],
+                "cvalue": [0.1],
+                "ptime": [[0, 30]],
+            },
+        }
+        model = self._model(config)
+        samples = [["Sector1"], ["Sector2"]]
+        impact = model.sampling_impact(samples)
+
+        impact_ans = []
+        for pinfra in samples:
+            model.set_perturbation(pinfra)
+            impact_ans.append(np.sum(model.impact(model.dynamic_inoperability())))
+
+        np.testing.assert_allclose(impact, impact_ans)
+
+    def test_excel_file(self):
+        fname = os.path.join("tests", "test_case10.xlsx")
+        config = {
+            "DIIM": {
+                "matrix_type": "interdependency",
+                "datafile": fname,
+                "amat_sheet_name": "A_matrix",
+                "kmat_sheet_name": "K_matrix",
+                "time_steps": 100,
+            },
+            "Perturbation": {
+                "pinfra": ["Sector2"],
+                "cvalue": [0.1],
+                "ptime": [[0, 30]],
+            },
+        }
+        model = self._model(config)
+        with pd.ExcelFile(fname) as xlsx:
+            config["DIIM"]["datafile"] = xlsx
+            model_xlsx = dpd.DIIM(config)
+
+        np.testing.assert_allclose(model_xlsx.astar, model.astar)
+        np.testing.assert_allclose(
+            model_xlsx.dynamic_inoperability(), model.dynamic_inoperability()
+        )
+
+    def test_analyze(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, "test_case10.xlsx")
+            shutil.copy(os.path.join("tests", "test_case10.xlsx"), fname)
+            config = {
+                "DIIM": {
+                    "matrix_type": "interdependency",
+                    "datafile": fname,
+                    "amat_sheet_name": "A_matrix",
+                    "kmat_sheet_name": "K_matrix",
+                    "time_steps": 100,
+                },
+                "Perturbation": {
+                    "pinfra": ["Sector2"],
+                    "cvalue": [0.1],
+                    "ptime": [[0, 30]],
+                },
+            }
+            model = dpd.DIIM(config)
+            with dpa.AnalysisSession(model) as session:
+                dpa.analyze_inoperability(model, "Static_session", wb=session.wb)
+                dpa.analyze_dynamic_inoperability(
+                    model, "Dynamic_session", wb=session.wb
+                )
+            df = dpa.analyze_inoperability(model)
+            _, qtot = dpa.analyze_dynamic_inoperability(model)
+
+            with pd.ExcelFile(fname) as xlsx:
+                for sheet_name in ["Static_inoperability", "Static_session"]:
+                    res = pd.read_excel(xlsx, sheet_name=sheet_name)
+                    self.assertEqual(list(df.columns), list(res.columns))
+                    np.testing.assert_allclose(
+                        res["inoperability"], model.inoperability()
+                    )
+                for sheet_name in ["Dynamic_inoperability", "Dynamic_session"]:
+                    res = pd.read_excel(xlsx, sheet_name=sheet_name)
+                    self.assertEqual(["time", *model.infra], list(res.columns))
+                    self.assertEqual(101, len(res))
+                    self.assertEqual("qtot", res.iloc[-1, 0])
+                    np.testing.assert_allclose(
+                        res.iloc[-1, 1:].astype(float), qtot
+                    )
+
+    def test_dtype(self):
+        # Same as test_case10 in single precision:
+        qtot_ans = [1.98014429, 3.36631738]
+
+        fname = os.path.join("tests", "test_case10.xlsx")
+        config = {
+            "DIIM": {
+                "matrix_type": "interdependency",
+                "datafile": fname,
+                "amat_sheet_name": "A_matrix",
+                "kmat_sheet_name": "K_matrix",
+                "time_steps": 100,
+                "dtype": "float32",
+            },
+            "Perturbation": {
+                "pinfra": ["Sector2"],
+                "cvalue": [0.1],
+                "ptime": [[0, 30]],
+            },
+        }
+        model = self._model(config)
+        qt = model.dynamic_inoperability()
+        qtot = model.impact(qt)
+
+        self.assertEqual(np.float32, model.astar.dtype)
+        np.testing.assert_allclose(qtot, qtot_ans, atol=0.001)
+
+        config["DIIM"]["dtype"] = "int32"
+        with self.assertRaises(Exception):
+            dpd.DIIM(config)
+
+    def test_plot_dynamic_legend(self):
+        # The legend of many long labels must fit in the saved figure.
+        labels = ["Infrastructure sector " + str(i).zfill(2) for i in range(20)]
+        qt = np.random.default_rng(1).random((20, len(labels)))
+        df = pd.DataFrame(qt, columns=labels)
+        df.insert(0, "time", np.arange(20))
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, "dynamic.png")
+            for ax in [None, dpp.pooled_axes(figsize=(9, 5))]:
+                ax = dpp.plot_dynamic(df, ax=ax, filename=fname)
+                fig = ax.figure
+                legend = (fig.legends or [ax.get_legend()])[0]
+                bbox = legend.get_window_extent()
+                self.assertTrue(
+                    fig.bbox.x0 <= bbox.x0 and bbox.x1 <= fig.bbox.x1
+                    and fig.bbox.y0 <= bbox.y0 and bbox.y1 <= fig.bbox.y1
+                )